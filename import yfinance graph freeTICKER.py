@@ -1,9 +1,7 @@
 import streamlit as st
-import yfinance as yf
 import datetime
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 
 # 設定頁面配置
 st.title("📈 股票價格與股息率分析")
@@ -61,6 +59,12 @@ execute_button = st.sidebar.button("🚀 執行分析", key="execute", use_conta
 
 # ============ 主要函數 ============
 
+# 數據表格及 CSV 下載顯示的欄位
+DISPLAY_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'DIVIDEND YIELD']
+
+class DataUnavailableError(Exception):
+    """無法從 Yahoo 取得數據（在快取函數內拋出，避免失敗結果被快取）"""
+
 def is_date_format(input_str):
     """檢查輸入是否為日期格式"""
     try:
@@ -69,47 +73,98 @@ def is_date_format(input_str):
     except ValueError:
         return False
 
+@st.cache_resource(ttl=3600, max_entries=32, show_spinner=False)
+def _get_ticker(ticker_symbol):
+    """取得（並重用）yfinance Ticker 物件
+
+    Ticker 內部快取的歷史數據永不過期，故與 _get_dividends 使用相同的一小時 TTL，
+    股息快取過期重取時必定建立新的 Ticker。
+    """
+    import yfinance as yf
+
+    return yf.Ticker(ticker_symbol)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _get_dividends(ticker_symbol):
+    """獲取股息數據（快取一小時）"""
+    dividends = _get_ticker(ticker_symbol).dividends
+    if dividends is None:
+        # 下載失敗的狀態會留在 Ticker 物件內，須丟棄讓下次重新建立
+        _get_ticker.clear()
+        raise DataUnavailableError(f"未能獲取 {ticker_symbol} 的股息數據")
+    return dividends
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _download_history(ticker_symbol, start_date, end_date):
+    """下載股價歷史數據（快取一小時）"""
+    import yfinance as yf
+
+    stock_data = yf.download(
+        ticker_symbol,
+        start=start_date,
+        end=end_date,
+        progress=False,
+        auto_adjust=False,
+        actions=False,
+        threads=False,
+        group_by='column'
+    )
+    # yf.download 出錯時多半只回傳空表，須拋出例外以免失敗結果被快取
+    if stock_data.empty:
+        raise DataUnavailableError(f"未能獲取 {ticker_symbol} 的股價數據")
+    return stock_data
+
 def plot_stock_charts(stock_data, ticker_symbol, start_date, end_date, annual_dividend, dividend_year):
     """繪製互動式股價和股息率圖表"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    # 日期索引及各欄位一次性轉為 numpy 陣列，避免重複取欄
+    # 日期以 epoch 毫秒 (float64) 傳入、配合 xaxis type='date'：datetime64 陣列仍會被
+    # Plotly 逐點輸出為 ISO 字串，數值陣列則以數字（Plotly 6+ 為二進位 typed array）序列化
+    x_arr = stock_data.index.to_numpy(dtype='datetime64[ms]').view('int64').astype(np.float64)
+    high = stock_data['High'].to_numpy()
+    low = stock_data['Low'].to_numpy()
+    close = stock_data['Close'].to_numpy()
+    dividend_yield = stock_data['DIVIDEND YIELD'].to_numpy()
     fig = make_subplots(specs=[[{"secondary_y": True}]])
 
     # === 添加股價數據（左側Y軸）===
     fig.add_trace(
-        go.Scatter(
-            x=stock_data.index,
-            y=stock_data['High'],
+        go.Scattergl(
+            x=x_arr,
+            y=high,
             fill=None,
             mode='lines',
             line=dict(width=0),
+            name='High',
             showlegend=False,
-            hoverinfo='skip'
+            hovertemplate='<b>High</b>: %{y:.2f}<br>' +
+                         '<extra></extra>'
         ),
         secondary_y=False
     )
 
     fig.add_trace(
-        go.Scatter(
-            x=stock_data.index,
-            y=stock_data['Low'],
+        go.Scattergl(
+            x=x_arr,
+            y=low,
             fill='tonexty',
             mode='lines',
             line=dict(width=0),
             fillcolor='rgba(162, 59, 114, 0.15)',
             name='Daily High-Low Range',
-            hovertemplate='<b>Date</b>: %{x|%Y-%m-%d}<br>' +
-                         '<b>High</b>: %{customdata[0]:.2f}<br>' +
-                         '<b>Low</b>: %{y:.2f}<br>' +
-                         '<extra></extra>',
-            customdata=stock_data[['High']].values
+            hovertemplate='<b>Low</b>: %{y:.2f}<br>' +
+                         '<extra></extra>'
         ),
         secondary_y=False
     )
 
     # 收盤價線
     fig.add_trace(
-        go.Scatter(
-            x=stock_data.index,
-            y=stock_data['Close'],
+        go.Scattergl(
+            x=x_arr,
+            y=close,
             mode='lines',
             name='Close Price',
             line=dict(color='#2E86AB', width=3),
@@ -121,10 +176,10 @@ def plot_stock_charts(stock_data, ticker_symbol, start_date, end_date, annual_di
     )
 
     # 標註最高價和最低價
-    max_price = stock_data['Close'].max()
-    min_price = stock_data['Close'].min()
-    max_date = stock_data['Close'].idxmax()
-    min_date = stock_data['Close'].idxmin()
+    imax = np.nanargmax(close)
+    imin = np.nanargmin(close)
+    max_price, min_price = close[imax], close[imin]
+    max_date, min_date = stock_data.index[imax], stock_data.index[imin]
 
     fig.add_annotation(
         x=max_date,
@@ -162,12 +217,12 @@ def plot_stock_charts(stock_data, ticker_symbol, start_date, end_date, annual_di
 
     # === 添加股息率數據（右側Y軸）===
     fig.add_trace(
-        go.Scatter(
-            x=stock_data.index,
-            y=stock_data['DIVIDEND YIELD'],
+        go.Scattergl(
+            x=x_arr,
+            y=dividend_yield,
             mode='lines',
             name=f'Dividend Yield ({dividend_year} data)',
-            line=dict(color='#F18F01', width=3, dash='2,2'),
+            line=dict(color='#F18F01', width=3, dash='dot'),
             fill='tozeroy',
             fillcolor='rgba(241, 143, 1, 0.2)',
             hovertemplate='<b>Date</b>: %{x|%Y-%m-%d}<br>' +
@@ -179,24 +234,28 @@ def plot_stock_charts(stock_data, ticker_symbol, start_date, end_date, annual_di
 
     # 添加平均股息率線
     if annual_dividend > 0:
-        avg_yield = stock_data['DIVIDEND YIELD'].mean()
-        fig.add_trace(
-            go.Scatter(
-                x=stock_data.index,
-                y=[avg_yield] * len(stock_data.index),
-                mode='lines',
-                name=f'Avg Yield: {avg_yield:.2f}%',
-                line=dict(color='red', width=2.5, dash='dot'),
-                hovertemplate='<b>Average Yield</b>: %{y:.2f}%<br>' +
-                             '<extra></extra>'
-            ),
+        avg_yield = np.nanmean(dividend_yield)
+        fig.add_hline(
+            y=avg_yield,
+            line=dict(color='red', width=2.5, dash='dot'),
             secondary_y=True
         )
+        # add_hline 的 annotation 會留在左軸 (y)，標籤需自行掛在右軸 (y2)
+        fig.add_annotation(
+            x=0,
+            y=avg_yield,
+            xref='paper',
+            yref='y2',
+            text=f'Avg Yield: {avg_yield:.2f}%',
+            showarrow=False,
+            xanchor='left',
+            yanchor='bottom',
+            font=dict(size=11, color='red')
+        )
 
     # === 計算右軸的動態範圍 ===
-    dividend_yield_data = stock_data['DIVIDEND YIELD']
-    min_yield = dividend_yield_data.min()
-    max_yield = dividend_yield_data.max()
+    min_yield = np.nanmin(dividend_yield)
+    max_yield = np.nanmax(dividend_yield)
     yield_range = max_yield - min_yield
     margin = yield_range * 0.1
 
@@ -215,6 +274,7 @@ def plot_stock_charts(stock_data, ticker_symbol, start_date, end_date, annual_di
             "xanchor": "center"
         },
         xaxis={
+            "type": "date",
             "title": "Date",
             "title_font": {"size": 14, "color": "black"},
             "showgrid": True,
@@ -256,58 +316,91 @@ def plot_stock_charts(stock_data, ticker_symbol, start_date, end_date, annual_di
         range=[y_axis_min, y_axis_max]
     )
 
-    # ❌ 移除 fig.show()，Streamlit 會在 st.plotly_chart() 中處理
-    # 保存為 HTML 文件（可選）
-    date_range = f"{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}"
-    html_filename = f'{ticker_symbol}_interactive_chart_{date_range}.html'
-    try:
-        fig.write_html(html_filename)
-        print(f"✅ Interactive chart saved to: {html_filename}")
-    except Exception as e:
-        print(f"⚠️ Could not save HTML file: {e}")
-
+    # ❌ 移除 fig.show()，由主程式嵌入頁面
     return fig  # ✅ 返回圖表物件而不是顯示它
 
+def _render_chart(stock_data, ticker_symbol, start_date, end_date, annual_dividend, dividend_year):
+    """繪製圖表並回傳 (嵌入用 HTML 片段, 下載用完整 HTML)"""
+    fig = plot_stock_charts(stock_data, ticker_symbol, start_date, end_date, annual_dividend, dividend_year)
+    chart_fragment = fig.to_html(
+        include_plotlyjs='cdn',
+        full_html=False,
+        div_id='chart',
+        config={'responsive': True}
+    )
+    chart_page = fig.to_html(include_plotlyjs='cdn')
+    return chart_fragment, chart_page
+
+def to_csv_bytes(df):
+    """將數據表轉為 CSV 位元組"""
+    return df.to_csv(index=True).encode('utf-8')
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _load_analysis(ticker_symbol, start_date, end_date):
+    """下載並整理數據、繪製圖表及產生 CSV
+
+    數據、圖表 HTML 與 CSV 存於同一快取項（一小時），表格、指標、圖表與下載必定來自同一份數據；
+    圖表及 CSV 只在快取未命中時建立，快取鍵只含代碼及日期範圍，不對 DataFrame 進行雜湊。
+    """
+    # 下載股價數據
+    dividends = _get_dividends(ticker_symbol)
+
+    # 確定使用哪一年的股息數據
+    current_year = end_date.year
+    previous_year = current_year - 1
+
+    # 按年份彙總股息（單次遍歷）
+    annual_by_year = dividends.groupby(dividends.index.year).sum()
+    current_annual_dividend = annual_by_year.get(current_year, 0.0)
+
+    if current_annual_dividend > 0:
+        annual_dividend = current_annual_dividend
+        dividend_year = current_year
+    else:
+        annual_dividend = annual_by_year.get(previous_year, 0.0)
+        dividend_year = previous_year
+
+    # 下載股價歷史數據
+    stock_data = _download_history(ticker_symbol, start_date, end_date)
+
+    # 處理多層索引
+    if isinstance(stock_data.columns, pd.MultiIndex):
+        stock_data.columns = stock_data.columns.droplevel(1)
+
+    # 縮減數值型別以節省記憶體與序列化大小
+    for col in ('Open', 'High', 'Low', 'Close'):
+        stock_data[col] = stock_data[col].astype('float32')
+    stock_data['Volume'] = pd.to_numeric(stock_data['Volume'], downcast='unsigned')
+
+    # 計算股息率
+    close_arr = stock_data['Close'].to_numpy()
+    stock_data['DIVIDEND YIELD'] = np.multiply(
+        np.divide(annual_dividend, close_arr), 100.0, dtype=np.float32
+    )
+
+    chart_fragment, chart_page = _render_chart(
+        stock_data, ticker_symbol, start_date, end_date, annual_dividend, dividend_year
+    )
+
+    csv_bytes = to_csv_bytes(stock_data[DISPLAY_COLUMNS])
+
+    return stock_data, annual_dividend, dividend_year, chart_fragment, chart_page, csv_bytes
+
 
 def fetch_and_analyze(ticker_symbol, start_date, end_date):
     """獲取數據並進行分析"""
     
     with st.spinner(f"⏳ 正在獲取 {ticker_symbol} 的數據..."):
         try:
-            # 下載股價數據
-            ticker = yf.Ticker(ticker_symbol)
-            dividends = ticker.dividends
-
-            # 確定使用哪一年的股息數據
-            current_year = end_date.year
-            previous_year = current_year - 1
-
-            current_year_dividends = dividends[dividends.index.year == current_year]
-            current_annual_dividend = current_year_dividends.sum() if not current_year_dividends.empty else 0.0
-
-            if current_annual_dividend > 0:
-                annual_dividend = current_annual_dividend
-                dividend_year = current_year
-            else:
-                previous_year_dividends = dividends[dividends.index.year == previous_year]
-                annual_dividend = previous_year_dividends.sum() if not previous_year_dividends.empty else 0.0
-                dividend_year = previous_year
-
-            # 下載股價歷史數據
-            stock_data = yf.download(ticker_symbol, start=start_date, end=end_date, progress=False)
-
-            if stock_data.empty:
-                st.error(f"❌ 未能獲取 {ticker_symbol} 的數據")
-                return None
-
-            # 處理多層索引
-            if isinstance(stock_data.columns, pd.MultiIndex):
-                stock_data.columns = stock_data.columns.droplevel(1)
+            (stock_data, annual_dividend, dividend_year,
+             chart_fragment, chart_page, csv_bytes) = _load_analysis(ticker_symbol, start_date, end_date)
 
-            # 計算股息率
-            stock_data['DIVIDEND YIELD'] = (annual_dividend / stock_data['Close']) * 100
+            return (stock_data, ticker_symbol, start_date, end_date, annual_dividend, dividend_year,
+                    chart_fragment, chart_page, csv_bytes)
 
-            return stock_data, ticker_symbol, start_date, end_date, annual_dividend, dividend_year
+        except DataUnavailableError:
+            st.error(f"❌ 未能獲取 {ticker_symbol} 的數據")
+            return None
 
         except Exception as e:
             st.error(f"❌ 發生錯誤: {e}")
@@ -320,14 +413,17 @@ if 'last_result' not in st.session_state:
     st.session_state.last_result = None
 
 # 執行分析
-if execute_button or st.session_state.last_result is None:
+if execute_button:
     result = fetch_and_analyze(ticker_input, start_date, end_date)
     if result:
         st.session_state.last_result = result
 
 # 顯示結果
-if st.session_state.last_result:
-    stock_data, ticker_symbol, start_date, end_date, annual_dividend, dividend_year = st.session_state.last_result
+if st.session_state.last_result is None:
+    st.info("👈 請在側邊欄設定參數後點擊「🚀 執行分析」")
+else:
+    (stock_data, ticker_symbol, start_date, end_date, annual_dividend, dividend_year,
+     chart_fragment, chart_page, csv_bytes) = st.session_state.last_result
 
     # 顯示統計信息
     col1, col2, col3, col4 = st.columns(4)
@@ -347,41 +443,42 @@ if st.session_state.last_result:
 
     # 顯示圖表
     st.subheader("📊 股價與股息率圖表")
-    fig = plot_stock_charts(stock_data, ticker_symbol, start_date, end_date, annual_dividend, dividend_year)
-    st.plotly_chart(fig, use_container_width=True)
+    # 以 CDN 版 plotly.js 嵌入，避免每次重跑重新注入整個 plotly.js
+    if hasattr(st, 'iframe'):
+        st.iframe(chart_fragment, height=720)
+    else:
+        # 舊版 Streamlit 尚無 st.iframe
+        import streamlit.components.v1 as components
+
+        components.html(chart_fragment, height=720)
+
+    # 下載互動圖表（HTML）
+    date_range = f"{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}"
+    st.download_button(
+        label="💾 下載互動圖表 (HTML)",
+        data=chart_page,
+        file_name=f"{ticker_symbol}_interactive_chart_{date_range}.html",
+        mime="text/html"
+    )
 
     # 顯示數據表格
     st.subheader("📋 詳細數據")
-    display_columns = ['Open', 'High', 'Low', 'Close', 'Volume', 'DIVIDEND YIELD']
+    display_df = stock_data[DISPLAY_COLUMNS]
+    column_config = {
+        col: st.column_config.NumberColumn(format='%.4f')
+        for col in ('Open', 'High', 'Low', 'Close', 'DIVIDEND YIELD')
+    }
     st.dataframe(
-        stock_data[display_columns].round(4),
+        display_df,
+        column_config=column_config,
         use_container_width=True,
         height=400
     )
 
     # 下載按鈕
-    csv = stock_data[display_columns].to_csv(index=True)
     st.download_button(
         label="💾 下載 CSV",
-        data=csv,
+        data=csv_bytes,
         file_name=f"{ticker_symbol}_stock_data_{start_date}_{end_date}.csv",
         mime="text/csv"
     )
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-